@@ -4,6 +4,7 @@
 
 import sys
 from csv import DictReader
+from functools import lru_cache
 from . import plot_antenna as aplot
 
 def parse_csv_measurement_data (args):
@@ -58,26 +59,42 @@ def parse_csv_measurement_data (args):
     return gdata_dict
 # end def parse_csv_measurement_data
 
-def main_csv_measurement_data (argv = sys.argv [1:], pic_io = None):
-    """ Parse a contributed measurement format, see docstring of
-        parse_csv_measurement_data.
-        The pic_io argument is for testing.
+@lru_cache (maxsize = None)
+def options_csv_measurement_data ():
+    """ Build the argument parser for main_csv_measurement_data once
     """
     cmd = aplot.options_general ()
     aplot.options_gain (cmd)
     cmd.add_argument ('filename', help = 'CSV File to parse and plot')
+    return cmd
+# end def options_csv_measurement_data
+
+def main_csv_measurement_data \
+    (argv = sys.argv [1:], pic_io = None, pic_format = 'png'):
+    """ Parse a contributed measurement format, see docstring of
+        parse_csv_measurement_data.
+        The pic_io and pic_format arguments are for testing, see main
+        in plot_antenna.
+    """
+    cmd  = options_csv_measurement_data ()
     args = aplot.process_args (cmd, argv)
+    run_csv_measurement_data (args, pic_io = pic_io, pic_format = pic_format)
+# end def main_csv_measurement_data
+
+def run_csv_measurement_data (args, pic_io = None, pic_format = 'png'):
+    """ Parse and plot measurement data with processed arguments
+    """
     # Set default polarization, we need this otherwise the sum isn't computed
     if not args.polarization:
         args.polarization ['sum'] = True
     if pic_io is not None:
         args.output_file = pic_io
-        args.save_format = 'png'
+        args.save_format = pic_format
     gdata = parse_csv_measurement_data (args)
     gp = aplot.Gain_Plot (args, gdata)
     gp.compute ()
     gp.plot ()
-# end def main_csv_measurement_data
+# end def run_csv_measurement_data
 
 if __name__ == '__main__':
     main_csv_measurement_data ()
@@ -2,6 +2,7 @@
 
 import sys
 from csv import DictReader
+from functools import lru_cache
 from . import plot_antenna as aplot
 from .plot_antenna import Impedance_Data
 
@@ -93,18 +94,34 @@ def parse_eznec_data (args):
     return gdata_dict, impedance
 # end def parse_eznec_data
 
-def main_eznec (argv = sys.argv [1:], pic_io = None):
-    """ Parse eznec far field data.
+@lru_cache (maxsize = None)
+def options_eznec ():
+    """ Build the argument parser for main_eznec once per process
     """
     cmd = aplot.options_general ()
     aplot.options_gain (cmd)
     aplot.options_swr  (cmd)
     cmd.add_argument ('filename', help = 'EZNEC far field data to plot')
+    return cmd
+# end def options_eznec
+
+def main_eznec (argv = sys.argv [1:], pic_io = None, pic_format = 'png'):
+    """ Parse eznec far field data.
+        For pic_io and pic_format see main in plot_antenna.
+    """
+    cmd  = options_eznec ()
     args = aplot.process_args (cmd, argv)
+    run_eznec (args, pic_io = pic_io, pic_format = pic_format)
+# end def main_eznec
+
+def run_eznec (args, pic_io = None, pic_format = 'png'):
+    """ Parse and plot eznec far field data with processed arguments
+    """
     if pic_io is not None:
         args.output_file = pic_io
-        args.save_format = 'png'
-    gdata, idata = parse_eznec_data (args)
+        args.save_format = pic_format
+    gdata, idata = aplot.parse_cache.get \
+        (args.filename, 'eznec', lambda: parse_eznec_data (args))
     if idata and not args.plot_vswr:
         args.plot_vswr = True
     if gdata and not args.elevation and not args.azimuth and not args.plot3d:
@@ -119,7 +136,7 @@ def main_eznec (argv = sys.argv [1:], pic_io = None):
     gp.idata = idata
     gp.compute ()
     gp.plot ()
-# end def main_eznec
+# end def run_eznec
 
 if __name__ == '__main__':
     main_eznec ()
@@ -2,6 +2,7 @@
 
 import sys
 import os
+import pickle
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
 import numpy as np
@@ -11,12 +12,15 @@ except AttributeError:
     NaN = np.NaN
 from html import escape
 from bisect import bisect
+from collections import OrderedDict
 try:
     from itertools import pairwise
 except ImportError:
     pairwise = None
 from mpl_toolkits.mplot3d import Axes3D
 from argparse import ArgumentParser, HelpFormatter
+from functools import lru_cache
+from importlib.util import find_spec
 from matplotlib import cm, __version__ as matplotlib_version, rcParams, ticker
 from matplotlib.widgets import Slider
 from matplotlib.patches import Rectangle
@@ -24,13 +28,10 @@ try:
     from smithplot.smithaxes import SmithAxes
 except ImportError:
     SmithAxes = None
-try:
-    import plotly.express as px
-    import plotly.graph_objects as go
-    from plotly.subplots import make_subplots
-    import pandas         as pd
-except ImportError:
-    px = None
+# Plotly is imported on first use by import_plotly, importing it takes
+# noticeable time and it is not needed when plotting with matplotlib
+have_plotly = bool (find_spec ('plotly') and find_spec ('pandas'))
+px = go = make_subplots = pd = None
 try:
     import stl
     from scipy.spatial import Delaunay
@@ -40,6 +41,17 @@ except ImportError:
 
 matplotlib_version_float = float ('.'.join (matplotlib_version.split ('.')[:2]))
 
+def import_plotly ():
+    """ Import plotly and pandas into the module globals
+    """
+    global px, go, make_subplots, pd
+    if px is None:
+        import plotly.graph_objects as go
+        from plotly.subplots import make_subplots
+        import pandas         as pd
+        import plotly.express as px
+# end def import_plotly
+
 Omega = "\u2126"
 ohm = ' %s' % Omega
 
@@ -269,6 +281,15 @@ class Gain_Data:
         self.pattern  = {}
     # end def __init__
 
+    def __getstate__ (self):
+        """ Don't pickle the parent, it is set when the gain data is
+            added to a Gain_Plot
+        """
+        state = dict (self.__dict__)
+        state ['parent'] = None
+        return state
+    # end def __getstate__
+
     def __len__ (self):
         return len (self.pattern)
     # end def __len__
@@ -554,12 +575,57 @@ class Loaded_Segment:
 
 # end class Loaded_Segment
 
+class Parse_Cache:
+    """ Cache for parsed input files
+        When the same file is plotted several times in one process (as
+        in the regression tests) parsing of large NEC output files
+        dominates the run time. Entries are keyed by file name,
+        modification time, the name of the parser and additional
+        parameters that influence parsing. The parser name makes sure
+        that different parsers of the same file never return each
+        other's data. Computing and plotting modify the parsed data, so each
+        hit must return a fresh copy: We store the parsed data pickled,
+        unpickling is much cheaper than parsing (and than a deepcopy).
+        The cache is disabled by default (size 0): A program plotting
+        a file only once would only pay for the pickling.
+    """
+
+    def __init__ (self, size = 0):
+        self.size  = size
+        self.cache = OrderedDict ()
+    # end def __init__
+
+    def get (self, filename, parser, parse, *key):
+        """ Return result of parse (called without arguments) for the
+            given filename, from the cache if possible. The parser is
+            a name identifying the parse function.
+        """
+        if not self.size:
+            return parse ()
+        key = (filename, os.stat (filename).st_mtime_ns, parser) + key
+        if key in self.cache:
+            self.cache.move_to_end (key)
+            return pickle.loads (self.cache [key])
+        result = parse ()
+        self.cache [key] = pickle.dumps (result, pickle.HIGHEST_PROTOCOL)
+        while len (self.cache) > self.size:
+            self.cache.popitem (last = False)
+        return result
+    # end def get
+
+# end class Parse_Cache
+
+parse_cache = Parse_Cache ()
+
 class Gain_Plot:
     plot_names   = \
         ( 'azimuth', 'elevation'
         , 'plot_vswr', 'plot3d', 'plot_geo', 'plot_smith'
         )
     update_names = set (('azimuth', 'elevation', 'plot3d'))
+    # Attributes populated by read_file
+    parsed_attributes = \
+        ('gdata', 'geo', 'idata', 'loaded_segs', 'seg_by_tag', 'segments')
     font_sans    = \
         "Helvetica, Nimbus Sans, Liberation Sans, Open Sans, arial, sans-serif"
     # Default colors for swr plot
@@ -607,6 +673,8 @@ class Gain_Plot:
         self.mpl_plot_key = None
         self.do_plotly    = (getattr (self.args, 'export_html', None)
                             or getattr (self.args, 'show_in_browser', None))
+        if self.do_plotly:
+            import_plotly ()
         if  (   getattr (args, 'plot_smith', None)
             and SmithAxes is None and not self.do_plotly
             ):
@@ -619,10 +687,27 @@ class Gain_Plot:
         filename = filename or args.filename
         # This populates gdata and might override title:
         gp = cls (args, gdata = {})
-        gp.read_file (filename)
+        parsed = parse_cache.get \
+            ( filename
+            , 'plot_antenna'
+            , lambda: gp.parse_file (filename)
+            , args.default_frequency
+            )
+        for name in cls.parsed_attributes:
+            setattr (gp, name, parsed [name])
+        for gd in gp.gdata.values ():
+            gd.parent = gp
         return gp
     # end def from_file
 
+    def parse_file (self, filename):
+        """ Read the file and return the parsed data as a dict indexed
+            by the names in parsed_attributes, see from_file.
+        """
+        self.read_file (filename)
+        return dict ((n, getattr (self, n)) for n in self.parsed_attributes)
+    # end def parse_file
+
     @property
     def legend_name (self):
         pol_key = ''
@@ -2488,7 +2573,7 @@ def options_general (cmd = None):
                     " might, e.g. be dBm of the receiver"
         , default = "dBi"
         )
-    if px is not None:
+    if have_plotly:
         cmd.add_argument \
             ( "-H", "--export-html"
             , help    = "Filename-prefix to export graphics as html, "
@@ -2772,10 +2857,10 @@ def process_args (cmd, argv = sys.argv [1:]):
     return args
 # end def process_args
 
-def main (argv = sys.argv [1:], pic_io = None):
-    """ The pic_io argument is for testing:
-        We put the picture into that file-like object if the pic_io
-        is not None.
+@lru_cache (maxsize = None)
+def options_main ():
+    """ Build the argument parser for main, the parser is not modified
+        by parsing so it is built only once per process.
     """
     cmd = options_general ()
     options_gain (cmd)
@@ -2787,11 +2872,26 @@ def main (argv = sys.argv [1:], pic_io = None):
         ( 'filename'
         , help    = 'File to parse and plot'
         )
-    args = process_args (cmd, argv)
+    return cmd
+# end def options_main
+
+def main (argv = sys.argv [1:], pic_io = None, pic_format = 'png'):
+    """ The pic_io argument is for testing:
+        We put the picture into that file-like object if the pic_io
+        is not None. The pic_format can be set to 'rgba' for matplotlib
+        to get the raw pixels without png encoding.
+    """
+    cmd = options_main ()
+    run (process_args (cmd, argv), pic_io = pic_io, pic_format = pic_format)
+# end def main
+
+def run (args, pic_io = None, pic_format = 'png'):
+    """ Parse and plot with already-processed arguments, see main
+    """
     # For regression testing:
     if pic_io is not None:
         args.output_file = pic_io
-        args.save_format = 'png'
+        args.save_format = pic_format
     gp = Gain_Plot.from_file (args)
     gp.compute ()
 
@@ -2815,7 +2915,7 @@ def main (argv = sys.argv [1:], pic_io = None):
         gp.plot ()
     except ValueError as err:
         print ('Error: %s' % err)
-# end def main
+# end def run
 
 if __name__ == '__main__':
     main ()
@@ -1,6 +1,203 @@
 #!/usr/bin/python3
 
+import os
+import subprocess
 import pytest
+import matplotlib
+
+# Never use an interactive backend for the tests, this is also safe
+# when running tests in parallel worker processes
+matplotlib.use ('Agg')
+
+def pytest_configure (config):
+    # Registered by pytest-xdist, register here, too, for runs without it
+    config.addinivalue_line \
+        ( 'markers'
+        , 'xdist_group (name): run tests with the same name in the same'
+          ' worker with --dist loadgroup'
+        )
+    config.addinivalue_line \
+        ( 'markers'
+        , 'golden: picture regression test comparing against a reference'
+          ' picture, deselected by --changed-only if nothing relevant'
+          ' changed'
+        )
+    # Record durations only in the controlling process, not in xdist
+    # workers, reports of the workers are sent to the controller
+    if not is_worker (config):
+        config.pluginmanager.register (Duration_Recorder (config))
+# end def pytest_configure
+
+def test_id (nodeid):
+    """ Node id without the group suffix added by pytest-xdist for
+        --dist loadgroup
+    """
+    return nodeid.split ('@', 1) [0]
+# end def test_id
+
+def pytest_sessionstart (session):
+    """ Regenerate the hash index of the reference pictures once before
+        any test runs: In the controlling process only, xdist workers
+        are started after this and load the new index.
+    """
+    config = session.config
+    if config.getoption ('regenerate_hashes') and not is_worker (config):
+        from test_plot import write_hash_index
+        write_hash_index ()
+# end def pytest_sessionstart
+
+def is_worker (config):
+    return hasattr (config, 'workerinput')
+# end def is_worker
+
+class Duration_Recorder:
+    """ Record the duration of each test in the pytest cache, used for
+        ordering the tests when running in parallel
+    """
+    cache_key = 'plot_antenna/durations'
+
+    def __init__ (self, config):
+        self.config    = config
+        self.durations = {}
+    # end def __init__
+
+    def pytest_runtest_logreport (self, report):
+        if report.when == 'call' and report.passed:
+            self.durations [test_id (report.nodeid)] = report.duration
+    # end def pytest_runtest_logreport
+
+    def pytest_sessionfinish (self, session):
+        cache = getattr (self.config, 'cache', None)
+        if cache is None or not self.durations:
+            return
+        durations = cache.get (self.cache_key, {})
+        durations.update (self.durations)
+        cache.set (self.cache_key, durations)
+    # end def pytest_sessionfinish
+
+# end class Duration_Recorder
+
+def pytest_addoption (parser):
+    parser.addoption \
+        ( '--render-cache'
+        , action = 'store_true'
+        , help   = 'Skip picture tests that passed before with unchanged'
+                   ' input, arguments, code and reference pictures,'
+                   ' clear with --cache-clear'
+        )
+    parser.addoption \
+        ( '--regenerate-hashes'
+        , action = 'store_true'
+        , help   = 'Recompute test/pics/hashes.json, the pixel hashes of'
+                   ' the reference pictures, after adding or changing'
+                   ' reference pictures'
+        )
+    parser.addoption \
+        ( '--changed-only'
+        , action  = 'store_true'
+        , help    = 'Run golden picture tests only if their input file,'
+                    ' reference pictures or any code changed compared to'
+                    ' the git revision given with --changed-since'
+        )
+    parser.addoption \
+        ( '--changed-since'
+        , metavar = 'REF'
+        , default = 'HEAD'
+        , help    = 'Git revision for --changed-only, default=%(default)s'
+        )
+# end def pytest_addoption
+
+def changed_files (ref):
+    """ Files changed against git revision ref including untracked
+        files. A failing git is a usage error, running all tests
+        instead would hide that the option had no effect.
+    """
+    changed = set ()
+    for cmd in \
+        ( ['git', 'diff', '--name-only', ref, '--']
+        , ['git', 'ls-files', '--others', '--exclude-standard']
+        ):
+        try:
+            out = subprocess.run \
+                (cmd, capture_output = True, text = True, check = True)
+        except OSError as err:
+            raise pytest.UsageError ('--changed-only: %s' % err)
+        except subprocess.CalledProcessError as err:
+            raise pytest.UsageError \
+                ( '--changed-only: "%s" failed: %s'
+                % (' '.join (cmd), err.stderr.strip ())
+                )
+        changed.update (out.stdout.split ())
+    return changed
+# end def changed_files
+
+def golden_unchanged (item, changed):
+    """ True if nothing the golden test item depends on has changed
+    """
+    params = item.callspec.params
+    if os.path.normpath (params ['infile']) in changed:
+        return False
+    for fn in changed:
+        if fn.endswith ('.py') or fn.endswith ('.toml'):
+            return False
+        if fn.startswith ('test/pics/'):
+            if fn.rsplit ('.', 2) [-2] == params ['name']:
+                return False
+    return True
+# end def golden_unchanged
+
+def sort_by_duration (config, items):
+    """ Longest processing time first: Sort the tests by the recorded
+        durations of their xdist group (or of the test itself if not
+        grouped), longest first. Tests of a group stay together. This
+        avoids a long group being started last when running in
+        parallel. Tests without a recorded duration are assumed to be
+        as long as the longest known test.
+    """
+    durations = config.cache.get (Duration_Recorder.cache_key, {})
+    if not durations:
+        return
+    unknown = max (durations.values ())
+    group_duration = {}
+    group_by_id    = {}
+    for item in items:
+        mark  = item.get_closest_marker ('xdist_group')
+        group = mark.args [0] if mark and mark.args else item.nodeid
+        group_by_id [item.nodeid] = group
+        group_duration [group] = \
+            ( group_duration.get (group, 0)
+            + durations.get (test_id (item.nodeid), unknown)
+            )
+    def key (item):
+        group = group_by_id [item.nodeid]
+        return (-group_duration [group], group)
+    items.sort (key = key)
+# end def sort_by_duration
+
+def pytest_collection_modifyitems (config, items):
+    # With xdist the workers collect, not the controller. All workers
+    # sort the same way so their collections stay identical.
+    if  (   getattr (config, 'cache', None) is not None
+        and is_worker (config)
+        and config.workerinput.get ('workercount', 1) > 1
+        ):
+        sort_by_duration (config, items)
+    if not config.getoption ('changed_only'):
+        return
+    changed = changed_files (config.getoption ('changed_since'))
+    selected   = []
+    deselected = []
+    for item in items:
+        if  (   item.get_closest_marker ('golden')
+            and golden_unchanged (item, changed)
+            ):
+            deselected.append (item)
+        else:
+            selected.append (item)
+    if deselected:
+        config.hook.pytest_deselected (items = deselected)
+        items [:] = selected
+# end def pytest_collection_modifyitems
 
 @pytest.hookimpl (tryfirst=True, hookwrapper=True)
 def pytest_runtest_makereport (item, call):
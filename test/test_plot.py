@@ -22,19 +22,24 @@
 # ****************************************************************************
 
 import os
-import unittest
+import json
 import pytest
-import filecmp
 import hashlib
 from PIL import Image
 from bisect import bisect_left
-from plot_antenna.plot_antenna import main
+from functools import lru_cache
+import plot_antenna
+from plot_antenna.plot_antenna import main, parse_cache, import_plotly
 from plot_antenna.contrib import main_csv_measurement_data
 from plot_antenna.eznec import main_eznec
 from io import BytesIO
 from glob import glob
 import matplotlib
-import plotly
+try:
+    import importlib.metadata as importlib_metadata
+except ImportError:
+    # Python 3.7 has no importlib.metadata
+    importlib_metadata = None
 try:    
     from smithplot.smithaxes import SmithAxes
 except ImportError:
@@ -59,684 +64,560 @@ except ImportError:
 # the next and the prior version
 #
 
-def pic_filename_and_glob (function_name):
-    """ Return picture file name and glob pattern
-        The glob pattern is without version number
+def neighbor_pictures (versions):
+    """ For each possible result idx of a binary search in the sorted
+        list of picture file names of a key return the pictures to
+        compare against: The next and the prior version or the last
+        two if we are after the end of the list.
+    """
+    l = len (versions)
+    neighbors = []
+    for idx in range (l + 1):
+        if idx >= l - 1:
+            neighbors.append (tuple (versions [l-2:]))
+        else:
+            neighbors.append (tuple (versions [idx:idx+2]))
+    return neighbors
+# end def neighbor_pictures
+
+def picture_index (directory = 'test/pics'):
+    """ Index all reference pictures once, picture names are of the
+        form <prefix>.<version>.<key>.png where the version contains
+        dots. Return a dict indexed by (key, version), a dict indexed
+        by key containing the sorted list of file names for that key
+        (used for the binary search of the nearest version) and a
+        dict indexed by key with the precomputed neighbor pictures
+        for each search result, see neighbor_pictures.
+    """
+    by_version = {}
+    by_key     = {}
+    with os.scandir (directory) as entries:
+        names = sorted (e.name for e in entries if e.name.endswith ('.png'))
+    for pic in names:
+        fn   = os.path.join (directory, pic)
+        name = pic [:-len ('.png')]
+        version, key = name.split ('.', 1) [1].rsplit ('.', 1)
+        by_version [(key, version)] = fn
+        by_key.setdefault (key, []).append (fn)
+    neighbors = dict ((k, neighbor_pictures (v)) for k, v in by_key.items ())
+    return by_version, by_key, neighbors
+# end def picture_index
+
+pictures_by_version, pictures_by_key, picture_neighbors = picture_index ()
+
+@lru_cache (maxsize = None)
+def package_version (name):
+    """ Get the version of an installed package from the package
+        metadata without importing it, empty if not installed. On
+        Python 3.7 without importlib.metadata fall back to importing
+        the package and using its __version__.
+    """
+    if importlib_metadata is None:
+        try:
+            module = __import__ (dict (Pillow = 'PIL').get (name, name))
+            return getattr (module, '__version__', '')
+        except ImportError:
+            return ''
+    try:
+        return importlib_metadata.version (name)
+    except importlib_metadata.PackageNotFoundError:
+        return ''
+# end def package_version
+
+def plotly_version ():
+    """ Importing plotly is only done when a plotly test runs, see
+        warm_plotly, so use the package metadata.
+    """
+    return package_version ('plotly')
+# end def plotly_version
+
+def pic_key_and_version (function_name):
+    """ Return picture key, version and picture file name prefix
     """
     assert function_name.startswith ('test_')
     key = function_name [5:]
     if key.endswith ('_plotly'):
-        version = plotly.__version__
-        pfx = 'P'
-    else:
-        version = matplotlib.__version__
-        pfx = 'M'
-    fn = 'test/pics/%(pfx)s.%(version)s.%(key)s.png' % locals ()
-    pattern  = 'test/pics/%(pfx)s.*.%(key)s.png' % locals ()
-    return fn, pattern
-# end def pic_filename_and_glob
+        return key, plotly_version (), 'P'
+    return key, matplotlib.__version__, 'M'
+# end def pic_key_and_version
+
+def pic_filename (function_name):
+    """ Return picture file name for the current version
+    """
+    key, version, pfx = pic_key_and_version (function_name)
+    return 'test/pics/%(pfx)s.%(version)s.%(key)s.png' % locals ()
+# end def pic_filename
 
 def hash_from_pic_obj (obj):
     """ Compute hash from picture
         Image.open can read from a file (given by name) or from a
         file-like object
-        We need to convert to ppm, the png format stores too much info
-        that is different for the same picture
+        We hash the decoded pixels as RGBA, the png format stores too
+        much info that is different for the same picture. This is the
+        same data matplotlib produces when saving in 'rgba' format.
+        The hash is returned as the raw digest, it is only compared,
+        never displayed.
     """
-    img = Image.open (obj, formats = ['PNG', 'png'])
-    io  = BytesIO ()
-    img.save (io, format = 'ppm')
-    return hashlib.sha1 (io.getvalue ()).hexdigest ()
+    img = Image.open (obj, formats = ['PNG'])
+    if img.mode != 'RGBA':
+        img = img.convert ('RGBA')
+    return hashlib.sha1 (img.tobytes ()).digest ()
 # end def hash_from_pic_obj
 
+# Precomputed pixel hashes of the reference pictures indexed by file
+# name, each entry is the hash of the file content (to detect changed
+# pictures) and the hash of the pixels, both in hex.
+hash_index_file = 'test/pics/hashes.json'
+
+def load_hash_index ():
+    try:
+        with open (hash_index_file) as f:
+            return json.load (f)
+    except FileNotFoundError:
+        return {}
+# end def load_hash_index
+
+hash_index = load_hash_index ()
+
+def file_hash (filename):
+    with open (filename, 'rb') as f:
+        return hashlib.sha1 (f.read ()).hexdigest ()
+# end def file_hash
+
+def write_hash_index ():
+    """ Recompute the hash index from all reference pictures, called
+        at session start for the --regenerate-hashes option, see
+        conftest
+    """
+    hash_index.clear ()
+    for fn in sorted (pictures_by_version.values ()):
+        hash_index [os.path.basename (fn)] = \
+            [file_hash (fn), hash_from_pic_obj (fn).hex ()]
+    with open (hash_index_file, 'w') as f:
+        json.dump (hash_index, f, indent = 1, sort_keys = True)
+        f.write ('\n')
+    hash_from_pic_file_cached.cache_clear ()
+# end def write_hash_index
+
+@lru_cache (maxsize = None)
+def hash_from_pic_file_cached (filename, mtime):
+    """ Reference pictures don't change during a run, some are needed
+        more than once (e.g. with --render-cache or when several
+        versions are candidates), decode each only once. The
+        modification time is part of the cache key only.
+        If the picture is in the hash index with unchanged content
+        the picture is not decoded at all.
+    """
+    entry = hash_index.get (os.path.basename (filename))
+    if entry and entry [0] == file_hash (filename):
+        return bytes.fromhex (entry [1])
+    return hash_from_pic_obj (filename)
+# end def hash_from_pic_file_cached
+
+def hash_from_pic_file (filename):
+    """ Hash of a reference picture file, cached
+    """
+    return hash_from_pic_file_cached \
+        (filename, os.stat (filename).st_mtime_ns)
+# end def hash_from_pic_file
+
 def get_picture_hash (function_name):
     """ Get picture hash from picture file via the function name and
         the current matplotlib version.
     """
-    cs = []
-    fn, pattern = pic_filename_and_glob (function_name)
+    key, version, pfx = pic_key_and_version (function_name)
+    fn = pictures_by_version.get ((key, version))
+    if fn is not None:
+        return [hash_from_pic_file (fn)]
+    versions = pictures_by_key.get (key)
+    if not versions:
+        return []
+    idx = bisect_left (versions, pic_filename (function_name))
+    return [hash_from_pic_file (n) for n in picture_neighbors [key][idx]]
+# end def get_picture_hash
+
+@pytest.fixture (scope = 'session', autouse = True)
+def warm_matplotlib ():
+    """ Matplotlib loads the font list on the first rendered figure.
+        Do this once per session (or once per worker when running in
+        parallel) so that the cost is not attributed to the first test.
+        Setting MPLCONFIGDIR to a persistent directory allows the font
+        cache to be reused across runs.
+    """
+    import matplotlib.pyplot as plt
+    fig = plt.figure ()
+    plt.plot ([0, 1], [0, 1])
+    fig.canvas.draw ()
+    plt.close (fig)
+# end def warm_matplotlib
+
+@pytest.fixture (scope = 'session')
+def warm_plotly ():
+    """ Plotly is imported on first use, do this once per session for
+        the plotly tests, not for every process that runs only
+        matplotlib tests. The first picture export also loads kaleido.
+    """
+    import_plotly ()
+    import plotly.graph_objects as go
+    fig = go.Figure ()
     try:
-        cs.append (hash_from_pic_obj (fn))
-    except FileNotFoundError:
+        fig.write_image (BytesIO (), format = 'png')
+    except (RuntimeError, ValueError):
+        # kaleido or the browser it needs is missing, this is reported
+        # by the plotly tests themselves
         pass
-    if not cs:
-        versions = list (sorted (glob (pattern)))
-        idx = bisect_left (versions, fn)
-        l   = len (versions)
-        if not l:
-            globfn = []
-        elif idx >= l - 1:
-            globfn = versions [l-2:]
-        else:
-            globfn = versions [idx:idx+2]
-        for name in globfn:
-            cs.append (hash_from_pic_obj (name))
-    return cs
-# end def get_picture_hash
+# end def warm_plotly
+
+@pytest.fixture (scope = 'session', autouse = True)
+def enable_parse_cache ():
+    """ Several test cases plot the same input file, parse it only once
+    """
+    parse_cache.size = 32
+    yield
+    parse_cache.size = 0
+    parse_cache.cache.clear ()
+# end def enable_parse_cache
+
+@pytest.fixture (scope = 'session', autouse = True)
+def clear_picture_hashes ():
+    """ Do not keep reference picture hashes beyond the session
+    """
+    yield
+    hash_from_pic_file_cached.cache_clear ()
+# end def clear_picture_hashes
+
+@lru_cache (maxsize = None)
+def source_hash ():
+    """ Hash of the plot_antenna sources, this test module and the
+        versions of the plotting and image libraries, used for the
+        render cache
+    """
+    h = hashlib.sha256 ()
+    h.update (matplotlib.__version__.encode ('ascii'))
+    for name in 'plotly', 'kaleido', 'Pillow':
+        h.update (package_version (name).encode ('ascii'))
+        h.update (b'\0')
+    sources = sorted (glob (os.path.join (plot_antenna.__path__ [0], '*.py')))
+    sources.append (__file__)
+    for fn in sources:
+        with open (fn, 'rb') as f:
+            h.update (f.read ())
+    return h.digest ()
+# end def source_hash
+
+def render_key (entry, args, reference_hashes):
+    """ Key for the --render-cache option: A test is skipped if it
+        passed with the same input file content, arguments, code and
+        reference pictures. The last of args is the input file.
+    """
+    h = hashlib.sha256 (source_hash ())
+    h.update (repr ((entry.__module__, entry.__name__, args)).encode ())
+    with open (args [-1], 'rb') as f:
+        h.update (f.read ())
+    for cs in sorted (reference_hashes):
+        h.update (cs)
+    return h.hexdigest ()
+# end def render_key
+
+@lru_cache (maxsize = 128)
+def render_cached (entry, args, fmt, mtime):
+    """ Render a picture, the modification time of the input file is
+        only used as part of the cache key so that a changed input
+        file is rendered again.
+    """
+    pic_io = BytesIO ()
+    entry (list (args), pic_io = pic_io, pic_format = fmt)
+    return pic_io.getvalue ()
+# end def render_cached
+
+def render (entry, args, fmt = 'png'):
+    """ Render a picture with the given entry point and arguments and
+        return the picture data. Rendering is deterministic, identical
+        renders (some reference pictures are produced with the same
+        arguments) are done only once per session. The number of
+        cached pictures is bounded to limit memory use.
+        With fmt 'rgba' matplotlib returns the raw pixels which saves
+        the png encoding and decoding for each test.
+    """
+    return render_cached (entry, args, fmt, os.stat (args [-1]).st_mtime_ns)
+# end def render
 
-def check_status_matplotlib (v):
+def check_status_matplotlib (*case):
     # Currently there are no instances of test failures
-    return v
+    return case
 # end def check_status_matplotlib
 
-def check_smith_available (v):
+def check_smith_available (*case):
     if SmithAxes is None:
-        return pytest.mark.xfail (v)
-    return check_status_matplotlib (v)
+        return pytest.param (*case, marks = pytest.mark.xfail)
+    return check_status_matplotlib (*case)
 # end def check_smith_available
 
-class Test_Plot (unittest.TestCase):
+# Test cases for the picture regression tests. Each case consists of
+# the name (used for the reference picture), the entry point, the input
+# file and the command line arguments (without the input file) as a
+# tuple, the tuples are built once at import time.
+plot_cases = \
+    [ check_status_matplotlib
+        ('azimuth', main, "test/12-el-1deg.pout", ("--azi",))
+    , ('azimuth_plotly', main, "test/12-el-1deg.pout", ("--azi", "-S"))
+    , check_status_matplotlib
+        ( 'azimuth_linear', main, "test/12-el-5deg.pout"
+        , ("--azi", "--scaling-method=linear")
+        )
+    , ( 'azimuth_linear_plotly', main, "test/12-el-5deg.pout"
+      , ("--azi", "-S", "--scaling-method=linear")
+      )
+    , check_status_matplotlib
+        ( 'azimuth_linear_voltage', main, "test/12-el-5deg.pout"
+        , ("--azi", "--scaling-method=linear_voltage")
+        )
+    , ( 'azimuth_linear_voltage_plotly', main, "test/12-el-5deg.pout"
+      , ("--azi", "-S", "--scaling-method=linear_voltage")
+      )
+    , check_status_matplotlib
+        ( 'azimuth_db', main, "test/12-el-5deg.pout"
+        , ("--azi", "--scaling-method=linear_db")
+        )
+    , ( 'azimuth_db_plotly', main, "test/12-el-5deg.pout"
+      , ("--azi", "-S", "--scaling-method=linear_db")
+      )
+    , check_status_matplotlib
+        ('elevation', main, "test/12-el-1deg.pout", ("--ele",))
+    , ('elevation_plotly', main, "test/12-el-1deg.pout", ("--ele", "-S"))
+    , check_status_matplotlib
+        ('3d', main, "test/12-el-5deg.pout", ("--title=", "--plot3d"))
+    , ( '3d_plotly', main, "test/12-el-5deg.pout"
+      , ("--title=", "--plot3d", "-S")
+      )
+    , check_status_matplotlib
+        ('plotall', main, "test/inverted-v.pout", ())
+    , check_status_matplotlib
+        ('vswr', main, "test/inverted-v.pout", ("--title=", "--vswr"))
+    , ( 'vswr_plotly', main, "test/inverted-v.pout"
+      , ("--title=", "--vswr", "-S")
+      )
+    , check_status_matplotlib
+        ( 'vswr_extended', main, "test/u29gbuv0.nout"
+        , ( "--title=", "--vswr", "--swr-show-bands", "--swr-show-imp"
+          , "--system-impedance=4050", "--width=700", "--height=400"
+          )
+        )
+    , ( 'vswr_extended_plotly', main, "test/u29gbuv0.nout"
+      , ( "-S", "--title=", "--vswr", "--swr-show-bands", "--swr-show-imp"
+        , "--system-impedance=4050", "--width=1000"
+        , "--axis-3-pos=1", "--legend-x=1.07"
+        )
+      )
+    , check_status_matplotlib
+        ('basic_output', main, "test/vdipole-01.bout", ("--ele",))
+    , ('basic_output_plotly', main, "test/vdipole-01.bout", ("--ele", "-S"))
+      # Original basic implementation can save gains to a file
+    , check_status_matplotlib
+        ( 'gainfile', main, "test/DP001.GNN"
+        , ("--ele", "--angle-azi=60", "--default-f=14MHz")
+        )
+    , ( 'gainfile_plotly', main, "test/DP001.GNN"
+      , ("--ele", "-S", "--angle-azi=60", "--default-f=14MHz")
+      )
+      # We also can parse nec2c output
+    , check_status_matplotlib
+        ('necfile', main, "test/12-el.nout", ("--azi", "--swr"))
+    , ('necfile_azi_plotly', main, "test/12-el.nout", ("--azi", "-S"))
+    , ( 'necfile_swr_plotly', main, "test/12-el.nout"
+      , ("--title=", "--swr", "-S")
+      )
+    , check_smith_available
+        ( 'smith', main, "test/u29gbuv0.nout"
+        , ("--smith", "--system-impedance=4050")
+        )
+    , ( 'smith_plotly', main, "test/u29gbuv0.nout"
+      , ("--smith", "--system-impedance=4050", "-S")
+      )
+    , ('geo', main, "test/inve802B.pout", ("--title=", "--geo"))
+    , ('geo_plotly', main, "test/inve802B.pout", ("--title=", "--geo", "-S"))
+    , ('geo_s_para', main, "test/inve802B_S.pout", ("--title=", "--geo"))
+    , ( 'geo_s_para_plotly', main, "test/inve802B_S.pout"
+      , ("--title=", "--geo", "-S")
+      )
+    , ( 'measurement', main_csv_measurement_data, "test/Messdaten.csv"
+      , ("--azi", "--polari=H")
+      )
+    , ( 'measurement_plotly', main_csv_measurement_data, "test/Messdaten.csv"
+      , ("--azi", "--polari=H", "-S")
+      )
+    , ( 'measurement_full', main_csv_measurement_data, "test/Messdaten.csv"
+      , ( "--ele", "--polari=H", "--polari=V", "--polari=sum"
+        , "--matp", "--angle-ele=10.3", "--interpol=2"
+        )
+      )
+    , ( 'measurement_full_plotly', main_csv_measurement_data
+      , "test/Messdaten.csv"
+      , ( "--ele", "--polari=H", "--polari=V", "--polari=sum"
+        , "--matp", "--angle-ele=10.3", "--interpol=2", "-S"
+        )
+      )
+    , ( 'geo_bug_plotly', main, "test/geo-bug.nout"
+      , ("--title=", "--geo", "-S")
+      )
+    , ('monopole', main, "test/diphalf.nout", ("--title=", "--geo"))
+    , ( 'monopole_plotly', main, "test/diphalf.nout"
+      , ("--title=", "--geo", "-S")
+      )
+    , ('old_mininec_ele', main, "test/mininec-1.bout", ("--ele",))
+    , ('old_mininec_ele_plotly', main, "test/mininec-1.bout", ("-S", "--ele"))
+    , ('old_mininec_geo', main, "test/mininec-1.bout", ("--geo",))
+    , ('old_mininec_geo_plotly', main, "test/mininec-1.bout", ("-S", "--geo"))
+    , ('mininec_3_ele', main, "test/mininec-3.bout", ("--ele",))
+    , ('mininec_3_ele_plotly', main, "test/mininec-3.bout", ("-S", "--ele"))
+    , ('mininec_3_geo', main, "test/mininec-3.bout", ("--geo",))
+    , ('mininec_3_geo_plotly', main, "test/mininec-3.bout", ("-S", "--geo"))
+    , ( 'swr_tickmarks', main, "test/inverted-v.pout"
+      , ("--vswr", "--swr-show-impedance")
+      )
+    , ( 'swr_tickmarks_plotly', main, "test/inverted-v.pout"
+      , ( "-S", "--vswr", "--swr-show-impedance", "--width=1000"
+        , "--height=500"
+        )
+      )
+      # Test limit the colored area of the band to the X plot range
+    , ( 'swr_band_range', main, "test/inverted-v.pout"
+      , ("--vswr", "--swr-show-bands", "--swr-show-impedance")
+      )
+    , ('asap_geo', main, "test/3-ele-10deg.aout", ('--geo',))
+    , ('asap_geo_plotly', main, "test/3-ele-10deg.aout", ('-S', '--geo'))
+    , ('asap_azi', main, "test/3-ele-10deg.aout", ('--azi',))
+    , ('asap_azi_plotly', main, "test/3-ele-10deg.aout", ('-S', '--azi'))
+    , ('asap_ele', main, "test/3-ele-10deg.aout", ('--ele',))
+    , ('asap_ele_plotly', main, "test/3-ele-10deg.aout", ('-S', '--ele'))
+    , ('asap_3d', main, "test/3-ele-10deg.aout", ('--ele',))
+    , ('asap_3d_plotly', main, "test/3-ele-10deg.aout", ('-S', '--3d'))
+    , ( 'asap_swr', main, "test/3-ele-10deg.aout"
+      , ('--swr', '--swr-show-impedance')
+      )
+    , ( 'asap_swr_plotly', main, "test/3-ele-10deg.aout"
+      , ("-S", "--swr", "--swr-show-imp", "--width=1000", "--legend-x=1.04")
+      )
+    , ('eznec_azi', main_eznec, "test/tapered.eout", ('--azi',))
+    , ('eznec_azi_plotly', main_eznec, "test/tapered.eout", ('-S', '--azi'))
+    , ('eznec_ele', main_eznec, "test/tapered.eout", ('--ele',))
+    , ('eznec_ele_plotly', main_eznec, "test/tapered.eout", ('-S', '--ele'))
+    , ('eznec_3d', main_eznec, "test/tapered.eout", ('--ele',))
+    , ('eznec_3d_plotly', main_eznec, "test/tapered.eout", ('-S', '--3d'))
+    , ( 'eznec_swr', main_eznec, "test/lastz.eout"
+      , ('--vswr', '--swr-show-imp')
+      )
+    , ( 'eznec_swr_plotly', main_eznec, "test/lastz.eout"
+      , ( "-S", "--vswr", "--swr-show-imp", "--width=1000", "--height=500"
+        , "--legend-x=1.04", "--axis-3-pos=.99"
+        )
+      )
+      # This tests a case where we had a parsing error in geo
+    , ('nec_geo_inv_v', main, "test/inverted-v-thin.nout", ('--ele',))
+    , ('4nec2_azi', main, 'test/dip-4n.4out', ('--azi',))
+    , ('4nec2_azi_plotly', main, 'test/dip-4n.4out', ('-S', '--azi'))
+    , ('4nec2_ele', main, 'test/dip-4n.4out', ('--ele',))
+    , ('4nec2_ele_plotly', main, 'test/dip-4n.4out', ('-S', '--ele'))
+    , ('4nec2_3d', main, 'test/dip-4n.4out', ('--3d',))
+    , ('4nec2_3d_plotly', main, 'test/dip-4n.4out', ('-S', '--3d'))
+    , ('4nec2_geo', main, 'test/dip-4n.4out', ('--geo',))
+    , ('4nec2_geo_plotly', main, 'test/dip-4n.4out', ('-S', '--geo'))
+    , ('4nec2_swr', main, 'test/dip-4n.4out', ('--swr',))
+    , ('fortran_swr', main, 'test/dip-som.out', ('--swr',))
+    ]
+
+def plot_param (case):
+    """ Make a pytest parameter from a test case, the case name is the
+        test id. Cases with the same input file are put into the same
+        xdist group so the parse cache can be used when running in
+        parallel with --dist loadgroup. All cases are marked golden,
+        they can be deselected with --changed-only. Plotly cases are
+        skipped if plotly support is not available (this needs plotly
+        and pandas, see have_plotly).
+    """
+    values = getattr (case, 'values', case)
+    marks  = list (getattr (case, 'marks', ()))
+    marks.append (pytest.mark.xdist_group (values [2]))
+    marks.append (pytest.mark.golden)
+    if values [0].endswith ('_plotly'):
+        marks.append \
+            ( pytest.mark.skipif
+                ( not plot_antenna.plot_antenna.have_plotly
+                , reason = 'needs plotly and pandas'
+                )
+            )
+    return pytest.param (*values, id = values [0], marks = marks)
+# end def plot_param
+
+class Test_Plot:
     debug = False
+    # One picture buffer is reused by all tests, it is emptied before
+    # each test
+    pic_io_pool = BytesIO ()
 
     @pytest.fixture (autouse=True)
     def cleanup (self, request):
-        self.test_name = request.node.name
-        self.pic_io = BytesIO ()
+        self.test_name   = request.node.name
+        self.pic_io      = self.pic_io_pool
+        self.pic_io.seek (0)
+        self.pic_io.truncate ()
+        self.pic_format  = 'png'
+        self.render_args = None
         yield
         rep_call = getattr (request.node, 'rep_call', None)
         rep_fail = \
             rep_call and not rep_call.passed and rep_call.outcome != 'skipped'
         if rep_fail or self.debug:
-            fn, _ = pic_filename_and_glob (self.test_name)
-            with open (fn + '.debug', 'wb') as f:
-                f.write (self.pic_io.getvalue ())
+            fn = pic_filename (self.test_name)
+            # The buffer view must be released before the pooled
+            # pic_io is truncated for the next test
+            with self.pic_io.getbuffer () as pic:
+                # Raw pixels are not viewable, render again as png
+                if pic and self.pic_format != 'png' and self.render_args:
+                    pic = render (*self.render_args)
+                with open (fn + '.debug', 'wb') as f:
+                    f.write (pic)
     # end def cleanup
 
     def compare_cs (self):
-        cs = hash_from_pic_obj (self.pic_io)
+        if self.pic_format == 'rgba':
+            with self.pic_io.getbuffer () as pic:
+                cs = hashlib.sha1 (pic).digest ()
+        else:
+            cs = hash_from_pic_obj (self.pic_io)
         assert cs in get_picture_hash (self.test_name)
     # end def compare_cs
 
     def test_cmdline_err (self):
         infile = "test/12-el-5deg.pout"
         args = ["--scaling-method=linear_db", "--scaling-mindb=7", infile]
-        self.assertRaises (ValueError, main, args)
+        with pytest.raises (ValueError):
+            main (args)
     # end def test_cmdline_err
 
-    @check_status_matplotlib
-    def test_azimuth (self):
-        infile = "test/12-el-1deg.pout"
-        args = ["--azi", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_azimuth
-
-    def test_azimuth_plotly (self):
-        infile = "test/12-el-1deg.pout"
-        args = ["--azi", "-S", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_azimuth_plotly
-
-    @check_status_matplotlib
-    def test_azimuth_linear (self):
-        infile = "test/12-el-5deg.pout"
-        args = ["--azi", "--scaling-method=linear", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_azimuth_linear
-
-    def test_azimuth_linear_plotly (self):
-        infile = "test/12-el-5deg.pout"
-        args = ["--azi", "-S", "--scaling-method=linear", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_azimuth_linear_plotly
-
-    @check_status_matplotlib
-    def test_azimuth_linear_voltage (self):
-        infile = "test/12-el-5deg.pout"
-        args = ["--azi", "--scaling-method=linear_voltage", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_azimuth_linear_voltage
-
-    def test_azimuth_linear_voltage_plotly (self):
-        infile = "test/12-el-5deg.pout"
-        args = ["--azi", "-S", "--scaling-method=linear_voltage", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_azimuth_linear_voltage_plotly
-
-    @check_status_matplotlib
-    def test_azimuth_db (self):
-        infile = "test/12-el-5deg.pout"
-        args = ["--azi", "--scaling-method=linear_db", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_azimuth_db
-
-    def test_azimuth_db_plotly (self):
-        infile = "test/12-el-5deg.pout"
-        args = ["--azi", "-S", "--scaling-method=linear_db", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_azimuth_db_plotly
-
-    @check_status_matplotlib
-    def test_elevation (self):
-        infile = "test/12-el-1deg.pout"
-        args = ["--ele", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_elevation
-
-    def test_elevation_plotly (self):
-        infile = "test/12-el-1deg.pout"
-        args = ["--ele", "-S", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_elevation_plotly
-
-    @check_status_matplotlib
-    def test_3d (self):
-        infile = "test/12-el-5deg.pout"
-        args = ["--title=", "--plot3d", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_3d
-
-    def test_3d_plotly (self):
-        infile = "test/12-el-5deg.pout"
-        args = ["--title=", "--plot3d", "-S", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_3d_plotly
-
-    @check_status_matplotlib
-    def test_plotall (self):
-        infile = "test/inverted-v.pout"
-        args = [infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_plotall
-
-    @check_status_matplotlib
-    def test_vswr (self):
-        infile = "test/inverted-v.pout"
-        args = ["--title=", "--vswr", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_vswr
-
-    def test_vswr_plotly (self):
-        infile = "test/inverted-v.pout"
-        args = ["--title=", "--vswr", "-S", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_vswr_plotly
-
-    @check_status_matplotlib
-    def test_vswr_extended (self):
-        infile = "test/u29gbuv0.nout"
-        args = '''--title= --vswr --swr-show-bands --swr-show-imp
-                  --system-impedance=4050 --width=700 --height=400'''
-        args = args.split ()
-        args.append (infile)
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_vswr_extended
-
-    def test_vswr_extended_plotly (self):
-        infile = "test/u29gbuv0.nout"
-        args = '''-S --title= --vswr --swr-show-bands --swr-show-imp
-                  --system-impedance=4050 --width=1000
-                  --axis-3-pos=1 --legend-x=1.07'''
-        args = args.split ()
-        args.append (infile)
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_vswr_extended_plotly
-
-    @check_status_matplotlib
-    def test_basic_output (self):
-        infile = "test/vdipole-01.bout"
-        args = ["--ele", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_basic_output
-
-    def test_basic_output_plotly (self):
-        infile = "test/vdipole-01.bout"
-        args = ["--ele", "-S", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_basic_output_plotly
-
-    @check_status_matplotlib
-    def test_gainfile (self):
-        """ Original basic implementation can save gains to a file
-        """
-        infile = "test/DP001.GNN"
-        args = ["--ele", "--angle-azi=60", "--default-f=14MHz", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_gainfile
-
-    def test_gainfile_plotly (self):
-        """ Original basic implementation can save gains to a file
-        """
-        infile = "test/DP001.GNN"
-        args = ["--ele", "-S", "--angle-azi=60", "--default-f=14MHz", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_gainfile_plotly
-
-    @check_status_matplotlib
-    def test_necfile (self):
-        """ We also can parse nec2c output
-        """
-        infile = "test/12-el.nout"
-        args = ["--azi", "--swr", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_necfile
-
-    def test_necfile_azi_plotly (self):
-        """ We also can parse nec2c output
-        """
-        infile = "test/12-el.nout"
-        args = ["--azi", "-S", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_necfile_azi_plotly
-
-    def test_necfile_swr_plotly (self):
-        """ We also can parse nec2c output
-        """
-        infile = "test/12-el.nout"
-        args = ["--title=", "--swr", "-S", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_necfile_swr_plotly
-
-    @check_smith_available
-    def test_smith (self):
-        infile = "test/u29gbuv0.nout"
-        args = ["--smith", "--system-impedance=4050", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_smith
-
-    def test_smith_plotly (self):
-        """ We also can parse nec2c output
-        """
-        infile = "test/u29gbuv0.nout"
-        args = ["--smith", "--system-impedance=4050", "-S", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_smith_plotly
-
-    def test_geo (self):
-        infile = "test/inve802B.pout"
-        args = ["--title=", "--geo", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_geo
-
-    def test_geo_plotly (self):
-        infile = "test/inve802B.pout"
-        args = ["--title=", "--geo", "-S", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_geo_plotly
-
-    def test_geo_s_para (self):
-        infile = "test/inve802B_S.pout"
-        args = ["--title=", "--geo", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_geo_s_para
-
-    def test_geo_s_para_plotly (self):
-        infile = "test/inve802B_S.pout"
-        args = ["--title=", "--geo", "-S", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_geo_s_para_plotly
-
-    def test_measurement (self):
-        infile = "test/Messdaten.csv"
-        args = ["--azi", "--polari=H", infile]
-        main_csv_measurement_data (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_measurement
-
-    def test_measurement_plotly (self):
-        infile = "test/Messdaten.csv"
-        args = ["--azi", "--polari=H", "-S", infile]
-        main_csv_measurement_data (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_measurement_plotly
-
-    def test_measurement_full (self):
-        infile = "test/Messdaten.csv"
-        args = [ "--ele", "--polari=H", "--polari=V", "--polari=sum"
-               , "--matp", "--angle-ele=10.3", "--interpol=2", infile
-               ]
-        main_csv_measurement_data (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_measurement_full
-
-    def test_measurement_full_plotly (self):
-        infile = "test/Messdaten.csv"
-        args = [ "--ele", "--polari=H", "--polari=V", "--polari=sum"
-               , "--matp", "--angle-ele=10.3", "--interpol=2", "-S", infile
-               ]
-        main_csv_measurement_data (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_measurement_full_plotly
-
-    def test_geo_bug_plotly (self):
-        infile = "test/geo-bug.nout"
-        args = ["--title=", "--geo", "-S", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_geo_bug_plotly
-
-    def test_monopole (self):
-        infile = "test/diphalf.nout"
-        args = ["--title=", "--geo", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_monopole
-
-    def test_monopole_plotly (self):
-        infile = "test/diphalf.nout"
-        args = ["--title=", "--geo", "-S", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_monopole_plotly
-
-    def test_old_mininec_ele (self):
-        infile = "test/mininec-1.bout"
-        args = ["--ele", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_old_mininec_ele
-
-    def test_old_mininec_ele_plotly (self):
-        infile = "test/mininec-1.bout"
-        args = ["-S", "--ele", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_old_mininec_ele_plotly
-
-    def test_old_mininec_geo (self):
-        infile = "test/mininec-1.bout"
-        args = ["--geo", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_old_mininec_geo
-
-    def test_old_mininec_geo_plotly (self):
-        infile = "test/mininec-1.bout"
-        args = ["-S", "--geo", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_old_mininec_geo_plotly
-
-    def test_mininec_3_ele (self):
-        infile = "test/mininec-3.bout"
-        args = ["--ele", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_mininec_3_ele
-
-    def test_mininec_3_ele_plotly (self):
-        infile = "test/mininec-3.bout"
-        args = ["-S", "--ele", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_mininec_3_ele_plotly
-
-    def test_mininec_3_geo (self):
-        infile = "test/mininec-3.bout"
-        args = ["--geo", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_mininec_3_geo
-
-    def test_mininec_3_geo_plotly (self):
-        infile = "test/mininec-3.bout"
-        args = ["-S", "--geo", infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_mininec_3_geo_plotly
-
-    def test_swr_tickmarks (self):
-        infile = "test/inverted-v.pout"
-        args = '--vswr --swr-show-impedance'.split ()
-        args.append (infile)
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_swr_tickmarks
-
-    def test_swr_tickmarks_plotly (self):
-        infile = "test/inverted-v.pout"
-        args = '-S --vswr --swr-show-impedance --width=1000 --height=500'
-        args = args.split ()
-        args.append (infile)
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_swr_tickmarks_plotly
-
-    def test_swr_band_range (self):
-        """ Test limit the colored area of the band to the X plot range
-        """
-        infile = "test/inverted-v.pout"
-        args = '--vswr --swr-show-bands --swr-show-impedance'.split ()
-        args.append (infile)
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_swr_band_range
-
-    def test_asap_geo (self):
-        infile = "test/3-ele-10deg.aout"
-        args = ['--geo', infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_asap_geo
-
-    def test_asap_geo_plotly (self):
-        infile = "test/3-ele-10deg.aout"
-        args = ['-S', '--geo', infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_asap_geo_plotly
-
-    def test_asap_azi (self):
-        infile = "test/3-ele-10deg.aout"
-        args = ['--azi', infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_asap_azi
-
-    def test_asap_azi_plotly (self):
-        infile = "test/3-ele-10deg.aout"
-        args = ['-S', '--azi', infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_asap_azi_plotly
-
-    def test_asap_ele (self):
-        infile = "test/3-ele-10deg.aout"
-        args = ['--ele', infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_asap_ele
-
-    def test_asap_ele_plotly (self):
-        infile = "test/3-ele-10deg.aout"
-        args = ['-S', '--ele', infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_asap_ele_plotly
-
-    def test_asap_3d (self):
-        infile = "test/3-ele-10deg.aout"
-        args = ['--ele', infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_asap_3d
-
-    def test_asap_3d_plotly (self):
-        infile = "test/3-ele-10deg.aout"
-        args = ['-S', '--3d', infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_asap_3d_plotly
-
-    def test_asap_swr (self):
-        infile = "test/3-ele-10deg.aout"
-        args = ['--swr', '--swr-show-impedance', infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_asap_swr
-
-    def test_asap_swr_plotly (self):
-        infile = "test/3-ele-10deg.aout"
-        args = '-S --swr --swr-show-imp --width=1000 --legend-x=1.04'.split ()
-        args.append (infile)
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_asap_swr_plotly
-
-    def test_eznec_azi (self):
-        infile = "test/tapered.eout"
-        args = ['--azi', infile]
-        main_eznec (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_eznec_azi
-
-    def test_eznec_azi_plotly (self):
-        infile = "test/tapered.eout"
-        args = ['-S', '--azi', infile]
-        main_eznec (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_eznec_azi_plotly
-
-    def test_eznec_ele (self):
-        infile = "test/tapered.eout"
-        args = ['--ele', infile]
-        main_eznec (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_eznec_ele
-
-    def test_eznec_ele_plotly (self):
-        infile = "test/tapered.eout"
-        args = ['-S', '--ele', infile]
-        main_eznec (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_eznec_ele_plotly
-
-    def test_eznec_3d (self):
-        infile = "test/tapered.eout"
-        args = ['--ele', infile]
-        main_eznec (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_eznec_3d
-
-    def test_eznec_3d_plotly (self):
-        infile = "test/tapered.eout"
-        args = ['-S', '--3d', infile]
-        main_eznec (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_eznec_3d_plotly
-
-    def test_eznec_swr (self):
-        infile = "test/lastz.eout"
-        args = ['--vswr', '--swr-show-imp', infile]
-        main_eznec (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_eznec_swr
-
-    def test_eznec_swr_plotly (self):
-        infile = "test/lastz.eout"
-        args = '''-S --vswr --swr-show-imp --width=1000 --height=500
-                  --legend-x=1.04 --axis-3-pos=.99'''.split ()
-        args.append (infile)
-        main_eznec (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_eznec_swr_plotly
-
-    def test_nec_geo_inv_v (self):
-        """ This tests a case where we had a parsing error in geo
-        """
-        infile = "test/inverted-v-thin.nout"
-        args = ['--ele', infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_nec_geo_inv_v
-
-    def test_4nec2_azi (self):
-        infile = 'test/dip-4n.4out'
-        args = ['--azi', infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_4nec2_azi
-
-    def test_4nec2_azi_plotly (self):
-        infile = 'test/dip-4n.4out'
-        args = ['-S', '--azi', infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_4nec2_azi_plotly
-
-    def test_4nec2_ele (self):
-        infile = 'test/dip-4n.4out'
-        args = ['--ele', infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_4nec2_ele
-
-    def test_4nec2_ele_plotly (self):
-        infile = 'test/dip-4n.4out'
-        args = ['-S', '--ele', infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_4nec2_ele_plotly
-
-    def test_4nec2_3d (self):
-        infile = 'test/dip-4n.4out'
-        args = ['--3d', infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_4nec2_3d
-
-    def test_4nec2_3d_plotly (self):
-        infile = 'test/dip-4n.4out'
-        args = ['-S', '--3d', infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_4nec2_3d_plotly
-
-    def test_4nec2_geo (self):
-        infile = 'test/dip-4n.4out'
-        args = ['--geo', infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_4nec2_geo
-
-    def test_4nec2_geo_plotly (self):
-        infile = 'test/dip-4n.4out'
-        args = ['-S', '--geo', infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_4nec2_geo_plotly
-
-    def test_4nec2_swr (self):
-        infile = 'test/dip-4n.4out'
-        args = ['--swr', infile]
-        main (args, pic_io = self.pic_io)
-        self.compare_cs ()
-    # end def test_4nec2_swr
-
-    def test_fortran_swr (self):
-        infile = 'test/dip-som.out'
-        args = ['--swr', infile]
-        main (args, pic_io = self.pic_io)
+    @pytest.mark.parametrize \
+        ( 'name,entry,infile,args'
+        , [plot_param (c) for c in plot_cases]
+        )
+    def test_plot (self, request, name, entry, infile, args):
+        self.test_name = 'test_' + name
+        args = (*args, infile)
+        key  = None
+        if request.config.getoption ('render_cache'):
+            key = 'plot_antenna/passed/' + render_key \
+                (entry, args, get_picture_hash (self.test_name))
+            if request.config.cache.get (key, False):
+                pytest.skip ('Unchanged since last successful run')
+        # Plotly (via kaleido) can only produce encoded pictures
+        if name.endswith ('_plotly'):
+            request.getfixturevalue ('warm_plotly')
+        else:
+            self.pic_format = 'rgba'
+        self.render_args = (entry, args)
+        self.pic_io.write (render (entry, args, self.pic_format))
         self.compare_cs ()
-    # end def test_fortran_swr
+        if key is not None:
+            request.config.cache.set (key, True)
+    # end def test_plot
 
 # end class Test_Plot
@@ -0,0 +1,163 @@
+# Copyright (C) 2022-24 Ralf Schlatterbeck. All rights reserved
+# Reichergasse 131, A-3411 Weidling
+# ****************************************************************************
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+#   The above copyright notice and this permission notice shall be included in
+#   all copies or substantial portions of the Software. 
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ****************************************************************************
+
+# Tests for the test selection and ordering helpers in conftest
+
+import pytest
+from conftest import Duration_Recorder, golden_unchanged, sort_by_duration
+from conftest import pytest_collection_modifyitems
+
+class Fake_Mark:
+    def __init__ (self, *args):
+        self.args = args
+    # end def __init__
+# end class Fake_Mark
+
+class Fake_Callspec:
+    def __init__ (self, **params):
+        self.params = params
+    # end def __init__
+# end class Fake_Callspec
+
+class Fake_Item:
+    def __init__ (self, nodeid, name = None, infile = None, group = None):
+        self.nodeid   = nodeid
+        self.callspec = Fake_Callspec (name = name, infile = infile)
+        self.group    = group
+    # end def __init__
+
+    def get_closest_marker (self, name):
+        if name == 'xdist_group' and self.group:
+            return Fake_Mark (self.group)
+        return None
+    # end def get_closest_marker
+# end class Fake_Item
+
+class Fake_Cache:
+    def __init__ (self, durations):
+        self.durations = durations
+    # end def __init__
+
+    def get (self, key, default):
+        assert key == Duration_Recorder.cache_key
+        return self.durations
+    # end def get
+# end class Fake_Cache
+
+class Fake_Config:
+    def __init__ (self, durations, workerinput = None):
+        self.cache = Fake_Cache (durations)
+        if workerinput is not None:
+            self.workerinput = workerinput
+    # end def __init__
+
+    def getoption (self, name):
+        assert name == 'changed_only'
+        return False
+    # end def getoption
+# end class Fake_Config
+
+class Test_Golden_Unchanged:
+    item = Fake_Item ('t[azimuth]', 'azimuth', 'test/12-el-1deg.pout')
+
+    @pytest.mark.parametrize \
+        ( 'changed,result'
+        , [ (set (), True)
+          , ({'README.rst', 'test/other.pout'}, True)
+          , ({'test/12-el-1deg.pout'}, False)
+          , ({'plot_antenna/eznec.py'}, False)
+          , ({'pyproject.toml'}, False)
+          , ({'test/pics/M.3.6.3.azimuth.png'}, False)
+          , ({'test/pics/M.3.6.3.azimuth_db.png'}, True)
+          , ({'test/pics/P.5.4.0.azimuth_plotly.png'}, True)
+          ]
+        )
+    def test_golden_unchanged (self, changed, result):
+        assert golden_unchanged (self.item, changed) == result
+    # end def test_golden_unchanged
+
+# end class Test_Golden_Unchanged
+
+class Test_Sort_By_Duration:
+
+    def items (self):
+        return \
+            [ Fake_Item ('a1', group = 'a')
+            , Fake_Item ('b1', group = 'b')
+            , Fake_Item ('a2', group = 'a')
+            , Fake_Item ('c')
+            , Fake_Item ('b2', group = 'b')
+            ]
+    # end def items
+
+    def order (self, durations):
+        items = self.items ()
+        sort_by_duration (Fake_Config (durations), items)
+        return [i.nodeid for i in items]
+    # end def order
+
+    def test_no_durations (self):
+        assert self.order ({}) == ['a1', 'b1', 'a2', 'c', 'b2']
+    # end def test_no_durations
+
+    def test_longest_group_first (self):
+        durations = dict (a1 = 1, a2 = 1, b1 = 2, b2 = 3, c = 4)
+        assert self.order (durations) == ['b1', 'b2', 'c', 'a1', 'a2']
+    # end def test_longest_group_first
+
+    def test_unknown_is_longest (self):
+        # c is unknown and counts as long as b2
+        durations = dict (a1 = 1, a2 = 1, b1 = 1, b2 = 3)
+        assert self.order (durations) == ['b1', 'b2', 'c', 'a1', 'a2']
+    # end def test_unknown_is_longest
+
+    # The collection hook sorts only in xdist workers of a parallel run:
+    # The xdist controller does not collect, and in workers the
+    # numprocesses option is reset.
+    @pytest.mark.parametrize \
+        ( 'workerinput,result'
+        , [ (None, ['a1', 'b1', 'a2', 'c', 'b2'])
+          , ( dict (workerid = 'gw0', workercount = 1)
+            , ['a1', 'b1', 'a2', 'c', 'b2']
+            )
+          , ( dict (workerid = 'gw1', workercount = 2)
+            , ['b1', 'b2', 'c', 'a1', 'a2']
+            )
+          ]
+        )
+    def test_collection_hook (self, workerinput, result):
+        durations = dict (a1 = 1, a2 = 1, b1 = 2, b2 = 3, c = 4)
+        items  = self.items ()
+        config = Fake_Config (durations, workerinput)
+        pytest_collection_modifyitems (config, items)
+        assert [i.nodeid for i in items] == result
+    # end def test_collection_hook
+
+    def test_xdist_group_suffix (self):
+        # pytest-xdist appends @group to the node id with loadgroup
+        items = [Fake_Item ('x@g', group = 'g'), Fake_Item ('y')]
+        sort_by_duration (Fake_Config (dict (x = 1, y = 5)), items)
+        assert [i.nodeid for i in items] == ['y', 'x@g']
+    # end def test_xdist_group_suffix
+
+# end class Test_Sort_By_Duration